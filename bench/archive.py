@@ -0,0 +1,127 @@
+#!/usr/bin/env python3
+#
+# Copyright 2016 W. Trevor King <wking@tremily.us>
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#     http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+
+"""Compare validating tarballs directly with extract-then-validate.
+
+Usage:
+
+  $ python3 bench/archive.py [BUNDLES [FILES [FILE_SIZE]]]
+
+generates BUNDLES (default 20) gzipped bundles with FILES (default
+1000) FILE_SIZE-byte (default 4096) files in their root filesystem,
+and reports the throughput of both approaches.  Each bundle is
+archived twice: once with config.json first (the best case for
+validating the archive directly, since the stream can stop early)
+and once with config.json after the root filesystem (the worst case,
+since the whole stream must be read).
+"""
+
+import json
+import os
+import shutil
+import sys
+import tarfile
+import tempfile
+import time
+
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+sys.path.insert(0, ROOT)
+
+from distribute import validate  # noqa: E402
+
+CONFIG = {
+    'ociVersion': '1.0.0-rc1',
+    'platform': {'os': 'linux', 'arch': 'amd64'},
+    'process': {
+        'terminal': False,
+        'user': {'uid': 0, 'gid': 0},
+        'args': ['sh'],
+        'env': ['PATH=/usr/bin:/bin'],
+        'cwd': '/',
+    },
+    'root': {'path': 'rootfs', 'readonly': True},
+    'mounts': [{'destination': '/proc', 'type': 'proc', 'source': 'proc'}],
+}
+
+
+def make_bundles(directory, bundles, files, file_size):
+    """Return (config-first archives, config-last archives)."""
+    config_first = []
+    config_last = []
+    content = os.urandom(file_size)
+    for i in range(bundles):
+        bundle = os.path.join(directory, 'bundle-{}'.format(i))
+        rootfs = os.path.join(bundle, 'rootfs')
+        os.makedirs(rootfs)
+        with open(os.path.join(bundle, 'config.json'), 'w') as f:
+            json.dump(CONFIG, f)
+        for j in range(files):
+            with open(os.path.join(rootfs, 'file-{}'.format(j)), 'wb') as f:
+                f.write(content)
+        archive = '{}-config-first.tar.gz'.format(bundle)
+        with tarfile.open(archive, 'w:gz') as tar:
+            tar.add(os.path.join(bundle, 'config.json'), arcname='config.json')
+            tar.add(rootfs, arcname='rootfs')
+        config_first.append(archive)
+        archive = '{}-config-last.tar.gz'.format(bundle)
+        with tarfile.open(archive, 'w:gz') as tar:
+            tar.add(rootfs, arcname='rootfs')
+            tar.add(os.path.join(bundle, 'config.json'), arcname='config.json')
+        config_last.append(archive)
+        shutil.rmtree(bundle)
+    return config_first, config_last
+
+
+def extract_then_validate(archive):
+    directory = tempfile.mkdtemp()
+    try:
+        with tarfile.open(archive) as tar:
+            tar.extractall(directory)
+        return validate(directory)
+    finally:
+        shutil.rmtree(directory)
+
+
+def bench(label, func, archives):
+    start = time.perf_counter()
+    for archive in archives:
+        result = func(archive)
+        if not result.wasSuccessful():
+            raise RuntimeError('{} failed for {}'.format(label, archive))
+    elapsed = time.perf_counter() - start
+    print('{}: {} bundles in {:.3f} s ({:.1f} bundles/s)'.format(
+        label, len(archives), elapsed, len(archives) / elapsed))
+
+
+def main(bundles=20, files=1000, file_size=4096):
+    os.chdir(ROOT)
+    directory = tempfile.mkdtemp()
+    try:
+        config_first, config_last = make_bundles(
+            directory, bundles, files, file_size)
+        for order, archives in [
+                ('config-first', config_first),
+                ('config-last', config_last)]:
+            bench('{} extract-then-validate'.format(order),
+                  extract_then_validate, archives)
+            bench('{} validate-archive'.format(order), validate, archives)
+    finally:
+        shutil.rmtree(directory)
+
+
+if __name__ == '__main__':
+    main(*(int(arg) for arg in sys.argv[1:]))
@@ -0,0 +1,120 @@
+#!/usr/bin/env python3
+#
+# Copyright 2016 W. Trevor King <wking@tremily.us>
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#     http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+
+"""Measure how distribute.py throughput scales with workers.
+
+Usage:
+
+  $ python3 bench/scaling.py [BUNDLES [SECONDS]]
+
+queues BUNDLES (default 4000) fake bundles and works through them
+with 1, 2, 4, ... 32 worker processes, both through a coordinator
+(work --connect) and directly against the database.  Workers sleep
+for SECONDS (default 0.014, about one real validation) instead of
+validating, so this measures the queue's own overhead, which is what
+all workers share, even on hosts with fewer CPUs than workers.
+"""
+
+import multiprocessing
+import os
+import shutil
+import socket
+import subprocess
+import sys
+import tempfile
+import time
+
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+sys.path.insert(0, ROOT)
+
+import distribute  # noqa: E402
+
+WORKERS = [1, 2, 4, 8, 16, 32]
+
+
+def _worker(database, address, seconds):
+    if address:
+        queue = distribute._Remote(address, retry=60, poll=0.1)
+    else:
+        queue = distribute.Queue(distribute.connect(database))
+
+    def check(path):
+        time.sleep(seconds)
+        return {'tests': 17, 'failures': [], 'errors': [], 'skipped': 1}
+
+    worker = '{}:{}'.format(socket.gethostname(), os.getpid())
+    distribute.work(
+        queue, worker, check, size=25, flush=25, flush_interval=60,
+        poll=0.1)
+
+
+def _free_port():
+    with socket.socket() as sock:
+        sock.bind(('127.0.0.1', 0))
+        return sock.getsockname()[1]
+
+
+def run(directory, bundles, seconds, workers, remote):
+    database = os.path.join(directory, 'queue-{}-{}.sqlite'.format(
+        workers, remote))
+    connection = distribute.connect(database)
+    distribute.add(
+        connection, ('/bundle-{}'.format(i) for i in range(bundles)))
+    connection.close()
+    server = address = None
+    if remote:
+        address = ('127.0.0.1', _free_port())
+        server = subprocess.Popen([
+            sys.executable, os.path.join(ROOT, 'distribute.py'), 'serve',
+            database, '--listen', '{}:{}'.format(*address)])
+    try:
+        start = time.perf_counter()
+        if not distribute.supervise(
+                _worker, (database, address, seconds), workers, 0):
+            raise RuntimeError('a worker failed')
+        elapsed = time.perf_counter() - start
+    finally:
+        if server is not None:
+            server.terminate()
+            server.wait()
+    connection = distribute.connect(database)
+    try:
+        done = distribute.status(connection).get('done', 0)
+    finally:
+        connection.close()
+    if done != bundles:
+        raise RuntimeError('only {} of {} bundles done'.format(done, bundles))
+    return bundles / elapsed
+
+
+def main(bundles=4000, seconds=0.014):
+    directory = tempfile.mkdtemp()
+    try:
+        print('workers  coordinator  database  ideal (bundles/s)')
+        for workers in WORKERS:
+            print('{:7d}  {:11.0f}  {:8.0f}  {:5.0f}'.format(
+                workers,
+                run(directory, bundles, seconds, workers, remote=True),
+                run(directory, bundles, seconds, workers, remote=False),
+                workers / seconds))
+    finally:
+        shutil.rmtree(directory)
+
+
+if __name__ == '__main__':
+    multiprocessing.set_start_method('fork')
+    main(*(type_(arg) for type_, arg in zip([int, float], sys.argv[1:])))
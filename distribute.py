@@ -0,0 +1,499 @@
+#!/usr/bin/env python3
+#
+# Copyright 2016 W. Trevor King <wking@tremily.us>
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#     http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+
+"""Validate many bundles with a SQLite work queue.
+
+Queue bundles with:
+
+  $ python3 distribute.py add queue.sqlite < bundle-paths
+
+then start a coordinator that owns the database:
+
+  $ python3 distribute.py serve queue.sqlite --listen 0.0.0.0:8000
+
+and any number of workers, on any number of hosts:
+
+  $ python3 distribute.py work --connect coordinator.example.com:8000 --jobs 8
+
+Workers talk to the coordinator over XML-RPC and never open the
+database themselves.  The coordinator has no authentication, so only
+listen on trusted networks.  On a single host you can skip the
+coordinator and point workers at the database directly:
+
+  $ python3 distribute.py work queue.sqlite --jobs 8
+
+Workers lease batches of pending bundles, validate them, and send the
+results back in groups of --flush.  Sending results renews the
+worker's lease on the rest of its batch once it is half expired, so a
+lease only expires if the worker dies or stops reporting for
+--lease-duration.  Bundles from an expired lease are handed out again
+one at a time, so a bundle that crashes its worker does not take the
+rest of its batch down with it.  Each of those single-bundle leases
+counts as an attempt, and after --attempts of them expire the bundle
+is marked failed.  Workers keep polling while other workers hold
+leases, so they pick up bundles from crashed workers.  With --jobs,
+crashed worker processes are restarted, up to --restarts times.
+
+All state lives in the database, so the coordinator and workers can
+be stopped and restarted at any time.  Remote workers keep retrying
+for up to --retry seconds while the coordinator is unreachable.
+Check progress and collect results with:
+
+  $ python3 distribute.py status queue.sqlite
+  $ python3 distribute.py results queue.sqlite
+"""
+
+import argparse
+import json
+import multiprocessing
+import multiprocessing.connection
+import os
+import socket
+import sqlite3
+import sys
+import time
+import unittest
+import xmlrpc.client
+import xmlrpc.server
+
+
+ROOT = os.path.dirname(os.path.abspath(__file__))
+
+SCHEMA = """
+CREATE TABLE IF NOT EXISTS bundles (
+  id INTEGER PRIMARY KEY,
+  path TEXT UNIQUE NOT NULL,
+  state TEXT NOT NULL DEFAULT 'pending',  -- pending, leased, done, failed
+  worker TEXT,
+  lease_expires REAL,
+  attempts INTEGER NOT NULL DEFAULT 0,  -- expired single-bundle leases
+  result TEXT
+);
+CREATE INDEX IF NOT EXISTS bundles_state ON bundles (state, lease_expires);
+CREATE INDEX IF NOT EXISTS bundles_state_id ON bundles (state, id);
+CREATE INDEX IF NOT EXISTS bundles_worker
+  ON bundles (worker, state, lease_expires);
+"""
+
+
+def validate(bundle):
+    """Run the test suite against bundle, returning the TestResult.
+
+    test.util loads the configuration when it is imported, so we drop
+    the test modules and import them again for each bundle.
+    """
+    os.environ['BUNDLE'] = bundle
+    for name in list(sys.modules):
+        if name == 'test' or name.startswith('test.'):
+            del sys.modules[name]
+    suite = unittest.defaultTestLoader.discover('test', top_level_dir=ROOT)
+    result = unittest.TestResult()
+    suite.run(result)
+    util = sys.modules.get('test.util')
+    if util is not None:
+        util.close()
+    return result
+
+
+def _message(traceback):
+    return traceback.rstrip().rsplit('\n', 1)[-1]
+
+
+def summarize(result):
+    """Return a JSON-serializable summary of a TestResult."""
+    return {
+        'tests': result.testsRun,
+        'failures': [
+            [test.id(), _message(traceback)]
+            for test, traceback in result.failures],
+        'errors': [
+            [test.id(), _message(traceback)]
+            for test, traceback in result.errors],
+        'skipped': len(result.skipped),
+    }
+
+
+def check(path):
+    """Validate the bundle at path, returning its summary."""
+    try:
+        return summarize(validate(path))
+    except Exception as error:
+        return {'error': '{}: {}'.format(type(error).__name__, error)}
+
+
+def connect(database):
+    # The coordinator serves requests from one thread at a time, but
+    # not necessarily the thread that opened the connection.
+    connection = sqlite3.connect(
+        database, timeout=60, isolation_level=None,
+        check_same_thread=False)
+    connection.execute('PRAGMA journal_mode=DELETE')
+    connection.executescript(SCHEMA)
+    return connection
+
+
+def add(connection, paths):
+    """Queue paths, ignoring any that are already queued.
+
+    Workers change into the repository directory, so paths should be
+    absolute.
+    """
+    connection.execute('BEGIN IMMEDIATE')
+    try:
+        connection.executemany(
+            'INSERT OR IGNORE INTO bundles (path) VALUES (?)',
+            ((path,) for path in paths))
+    except BaseException:
+        connection.execute('ROLLBACK')
+        raise
+    connection.execute('COMMIT')
+
+
+class Queue(object):
+    """Leases bundles from the queue database and records results.
+
+    The coordinator serves these methods over XML-RPC, so they only
+    take and return XML-RPC-friendly values.
+    """
+
+    def __init__(self, connection, duration=600, attempts=3):
+        self.connection = connection
+        self.duration = duration
+        self.attempts = attempts
+
+    def _transaction(self, func):
+        self.connection.execute('BEGIN IMMEDIATE')
+        try:
+            value = func(time.time())
+        except BaseException:
+            self.connection.execute('ROLLBACK')
+            raise
+        self.connection.execute('COMMIT')
+        return value
+
+    def lease(self, worker, size):
+        """Lease bundles to worker, returning [[bundle_id, path], ...].
+
+        Returns up to size pending bundles, or a single bundle whose
+        lease has expired.  Expired bundles that have already used up
+        their attempts are marked failed instead.
+        """
+        def lease(now):
+            self.connection.execute(
+                "UPDATE bundles SET state = 'failed', worker = NULL, "
+                "result = ? "
+                "WHERE state = 'leased' AND lease_expires < ? "
+                "AND attempts >= ?",
+                (json.dumps({'error': 'lease expired {} times'.format(
+                    self.attempts)}),
+                 now, self.attempts))
+            rows = self.connection.execute(
+                "SELECT id, path FROM bundles WHERE state = 'leased' "
+                "AND lease_expires < ? LIMIT 1",
+                (now,)).fetchall()
+            if rows:
+                self.connection.execute(
+                    "UPDATE bundles SET worker = ?, lease_expires = ?, "
+                    "attempts = attempts + 1 WHERE id = ?",
+                    (worker, now + self.duration, rows[0][0]))
+                return [list(row) for row in rows]
+            rows = self.connection.execute(
+                "SELECT id, path FROM bundles WHERE state = 'pending' "
+                "ORDER BY id LIMIT ?",
+                (size,)).fetchall()
+            self.connection.executemany(
+                "UPDATE bundles SET state = 'leased', worker = ?, "
+                "lease_expires = ? WHERE id = ?",
+                ((worker, now + self.duration, bundle_id)
+                 for bundle_id, _ in rows))
+            return [list(row) for row in rows]
+        return self._transaction(lease)
+
+    def complete(self, worker, results):
+        """Record [[bundle_id, summary], ...] for bundles leased to worker.
+
+        Results for bundles whose lease has since moved to another
+        worker are dropped.  The rest of worker's leases are renewed
+        if they are more than half expired.  Returns the number of
+        results recorded.
+        """
+        def complete(now):
+            cursor = self.connection.executemany(
+                "UPDATE bundles SET state = 'done', result = ? "
+                "WHERE id = ? AND state = 'leased' AND worker = ?",
+                ((json.dumps(summary), bundle_id, worker)
+                 for bundle_id, summary in results))
+            recorded = cursor.rowcount
+            self.connection.execute(
+                "UPDATE bundles SET lease_expires = ? "
+                "WHERE worker = ? AND state = 'leased' "
+                "AND lease_expires < ?",
+                (now + self.duration, worker, now + self.duration / 2))
+            return recorded
+        return self._transaction(complete)
+
+    def busy(self):
+        """Return True if any bundles are leased."""
+        return self.connection.execute(
+            "SELECT 1 FROM bundles WHERE state = 'leased' LIMIT 1"
+        ).fetchone() is not None
+
+
+class _Remote(object):
+    """Queue proxy for a coordinator, retrying while it is unreachable."""
+
+    def __init__(self, address, retry, poll):
+        self._proxy = xmlrpc.client.ServerProxy(
+            'http://{}:{}/'.format(*address), allow_none=True)
+        self._retry = retry
+        self._poll = poll
+
+    def __getattr__(self, name):
+        method = getattr(self._proxy, name)
+
+        def call(*args):
+            deadline = time.time() + self._retry
+            while True:
+                try:
+                    return method(*args)
+                except OSError:
+                    if time.time() >= deadline:
+                        raise
+                    time.sleep(self._poll)
+        return call
+
+
+def parse_address(address):
+    """Parse HOST:PORT (HOST may be empty) into (host, port)."""
+    host, port = address.rsplit(':', 1)
+    return host, int(port)
+
+
+class _Server(xmlrpc.server.SimpleXMLRPCServer):
+    # Each call is a new connection, so many workers overflow the
+    # default backlog of 5 and then stall on SYN retries.
+    request_queue_size = 1024
+
+
+def make_server(database, address, duration, attempts):
+    """Return an XML-RPC server for the queue in database."""
+    server = _Server(
+        address, allow_none=True, logRequests=False)
+    server.register_instance(Queue(connect(database), duration, attempts))
+    return server
+
+
+def serve(database, address, duration, attempts):
+    """Serve the queue in database to workers until interrupted."""
+    server = make_server(database, address, duration, attempts)
+    try:
+        server.serve_forever()
+    finally:
+        server.server_close()
+        server.instance.connection.close()
+
+
+def work(queue, worker, check, size, flush, flush_interval, poll):
+    """Lease and check bundles until none are pending or leased.
+
+    Results are sent to the queue in groups of flush, or every
+    flush_interval seconds, whichever comes first.  While only
+    bundles leased to other workers remain, sleep for poll seconds
+    between attempts, in case those leases expire.
+    """
+    while True:
+        rows = queue.lease(worker, size)
+        if not rows:
+            if not queue.busy():
+                return
+            time.sleep(poll)
+            continue
+        results = []
+        flushed = time.time()
+        for bundle_id, path in rows:
+            results.append([bundle_id, check(path)])
+            if (len(results) >= flush or
+                    time.time() - flushed >= flush_interval):
+                queue.complete(worker, results)
+                results = []
+                flushed = time.time()
+        if results:
+            queue.complete(worker, results)
+
+
+def _work(args):
+    """Entry point for a worker process."""
+    sys.path.insert(0, ROOT)
+    os.chdir(ROOT)
+    worker = '{}:{}'.format(socket.gethostname(), os.getpid())
+    if args.connect:
+        queue = _Remote(parse_address(args.connect), args.retry, args.poll)
+        connection = None
+    else:
+        connection = connect(args.database)
+        queue = Queue(connection, args.lease_duration, args.attempts)
+    try:
+        work(queue, worker, check, args.lease_size, args.flush,
+             args.flush_interval, args.poll)
+    finally:
+        if connection is not None:
+            connection.close()
+
+
+def supervise(target, args, jobs, restarts):
+    """Run jobs copies of target(*args), restarting ones that crash.
+
+    Returns False if a worker still failed after restarts restarts.
+    """
+    processes = []
+    for _ in range(jobs):
+        process = multiprocessing.Process(target=target, args=args)
+        process.start()
+        processes.append(process)
+    ok = True
+    while processes:
+        multiprocessing.connection.wait(
+            [process.sentinel for process in processes])
+        for process in [p for p in processes if not p.is_alive()]:
+            processes.remove(process)
+            process.join()
+            if process.exitcode == 0:
+                continue
+            if restarts <= 0:
+                ok = False
+                continue
+            restarts -= 1
+            print('worker {} exited with {}; restarting'.format(
+                process.pid, process.exitcode), file=sys.stderr)
+            process = multiprocessing.Process(target=target, args=args)
+            process.start()
+            processes.append(process)
+    return ok
+
+
+def status(connection):
+    """Return {state: count, ...} for the queue."""
+    return dict(connection.execute(
+        'SELECT state, COUNT(*) FROM bundles GROUP BY state'))
+
+
+def results(connection):
+    """Yield (path, state, result) for finished bundles."""
+    for path, state, result in connection.execute(
+            "SELECT path, state, result FROM bundles "
+            "WHERE state IN ('done', 'failed') ORDER BY id"):
+        yield path, state, json.loads(result)
+
+
+def _add_queue_arguments(parser):
+    parser.add_argument(
+        '--lease-duration', type=float, default=600,
+        help='seconds before an unrenewed lease is handed out again')
+    parser.add_argument(
+        '--attempts', type=int, default=3,
+        help=('expired single-bundle leases to allow for a bundle '
+              'before marking it failed'))
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(
+        description='Validate many bundles with a SQLite work queue.')
+    subparsers = parser.add_subparsers(dest='command')
+    subparsers.required = True
+    for command, description in [
+            ('add', 'queue bundle paths read from stdin, one per line'),
+            ('status', 'count bundles in each state'),
+            ('results', 'print finished bundles as JSON, one per line')]:
+        subparser = subparsers.add_parser(command, help=description)
+        subparser.add_argument(
+            'database', help='path to the queue database')
+    serve_parser = subparsers.add_parser(
+        'serve', help='serve the queue to workers over XML-RPC')
+    serve_parser.add_argument('database', help='path to the queue database')
+    serve_parser.add_argument(
+        '--listen', default='localhost:8000', metavar='HOST:PORT',
+        help='address to listen on (default: %(default)s)')
+    _add_queue_arguments(serve_parser)
+    work_parser = subparsers.add_parser(
+        'work', help='validate queued bundles until all are finished')
+    work_parser.add_argument(
+        'database', nargs='?',
+        help='path to the queue database, if not using --connect')
+    work_parser.add_argument(
+        '--connect', metavar='HOST:PORT',
+        help='lease bundles from the coordinator at this address')
+    work_parser.add_argument(
+        '--jobs', type=int, default=1,
+        help='number of worker processes to run on this host')
+    work_parser.add_argument(
+        '--restarts', type=int, default=10,
+        help='times to restart crashed worker processes (with --jobs)')
+    work_parser.add_argument(
+        '--lease-size', type=int, default=100,
+        help='number of bundles to lease at a time')
+    work_parser.add_argument(
+        '--flush', type=int, default=25,
+        help='number of results to send back at a time')
+    work_parser.add_argument(
+        '--flush-interval', type=float, default=60,
+        help=('most seconds to hold results before sending them back; '
+              'keep this under half of --lease-duration'))
+    work_parser.add_argument(
+        '--poll', type=float, default=10,
+        help='seconds to wait before checking for expired leases')
+    work_parser.add_argument(
+        '--retry', type=float, default=600,
+        help='seconds to keep retrying an unreachable coordinator')
+    _add_queue_arguments(work_parser)
+    args = parser.parse_args(argv)
+    if args.database:
+        # workers change directory
+        args.database = os.path.abspath(args.database)
+
+    if args.command == 'serve':
+        serve(args.database, parse_address(args.listen),
+              args.lease_duration, args.attempts)
+        return
+
+    if args.command == 'work':
+        if bool(args.database) == bool(args.connect):
+            parser.error('work needs exactly one of database or --connect')
+        if args.database:
+            connect(args.database).close()  # create the schema once
+        if args.jobs == 1:
+            _work(args)
+        elif not supervise(_work, (args,), args.jobs, args.restarts):
+            sys.exit(1)
+        return
+
+    connection = connect(args.database)
+    try:
+        if args.command == 'add':
+            add(connection, (os.path.abspath(line.strip())
+                             for line in sys.stdin if line.strip()))
+        elif args.command == 'status':
+            for state, count in sorted(status(connection).items()):
+                print('{}: {}'.format(state, count))
+        elif args.command == 'results':
+            for path, state, result in results(connection):
+                print(json.dumps(
+                    {'path': path, 'state': state, 'result': result}))
+    finally:
+        connection.close()
+
+
+if __name__ == '__main__':
+    main()
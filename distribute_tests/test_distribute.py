@@ -0,0 +1,212 @@
+# Copyright 2016 W. Trevor King <wking@tremily.us>
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#     http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+
+"""Tests for the distribute.py work queue.
+
+These live outside the test package, which holds the validation
+rules.  Run them from the repository root with:
+
+  $ python3 -m unittest discover -s distribute_tests
+"""
+
+import json
+import os
+import shutil
+import tempfile
+import threading
+import time
+import unittest
+
+import distribute
+
+
+def _summary(path):
+    return {'path': path}
+
+
+def _crash_once(flag):
+    """Exit non-zero the first time, then succeed."""
+    if not os.path.exists(flag):
+        open(flag, 'w').close()
+        os._exit(1)
+
+
+class QueueTest(unittest.TestCase):
+    def setUp(self):
+        self.directory = tempfile.mkdtemp()
+        self.database = os.path.join(self.directory, 'queue.sqlite')
+        self.connection = distribute.connect(self.database)
+        self.paths = ['/bundle-{}'.format(i) for i in range(5)]
+        distribute.add(self.connection, self.paths)
+        self.queue = distribute.Queue(self.connection, duration=60)
+
+    def tearDown(self):
+        self.connection.close()
+        shutil.rmtree(self.directory)
+
+    def expire(self, worker):
+        self.connection.execute(
+            'UPDATE bundles SET lease_expires = 0 WHERE worker = ?',
+            (worker,))
+
+    def row(self, path):
+        state, worker, attempts, result = self.connection.execute(
+            'SELECT state, worker, attempts, result FROM bundles '
+            'WHERE path = ?', (path,)).fetchone()
+        if result is not None:
+            result = json.loads(result)
+        return state, worker, attempts, result
+
+    def test_lease_batches(self):
+        rows = self.queue.lease('a', 3)
+        self.assertEqual([path for _, path in rows], self.paths[:3])
+        rows = self.queue.lease('b', 3)
+        self.assertEqual([path for _, path in rows], self.paths[3:])
+        self.assertEqual(self.queue.lease('c', 3), [])
+        self.assertTrue(self.queue.busy())
+
+    def test_expired_lease_is_released_one_at_a_time(self):
+        self.queue.lease('a', 5)
+        self.expire('a')
+        rows = self.queue.lease('b', 5)
+        self.assertEqual([path for _, path in rows], self.paths[:1])
+        self.assertEqual(self.row(self.paths[0])[1:3], ('b', 1))
+        self.assertEqual(self.row(self.paths[1])[1:3], ('a', 0))
+
+    def test_attempt_limit_only_fails_the_crashing_bundle(self):
+        self.queue.attempts = 2
+        self.queue.lease('a', 5)
+        self.expire('a')  # the whole batch crashed on paths[0]
+        for worker in ['b', 'c']:  # paths[0] crashes two more workers
+            rows = self.queue.lease(worker, 5)
+            self.assertEqual([path for _, path in rows], self.paths[:1])
+            self.expire(worker)
+        while True:
+            rows = self.queue.lease('d', 5)
+            if not rows:
+                break
+            self.queue.complete(
+                'd', [[bundle_id, _summary(path)] for bundle_id, path in rows])
+        self.assertEqual(
+            self.row(self.paths[0])[::3],
+            ('failed', {'error': 'lease expired 2 times'}))
+        for path in self.paths[1:]:
+            self.assertEqual(self.row(path)[::3], ('done', _summary(path)))
+        self.assertFalse(self.queue.busy())
+
+    def test_complete_after_lease_moves_is_dropped(self):
+        (bundle_id, path), = self.queue.lease('a', 1)
+        self.expire('a')
+        self.assertEqual(self.queue.lease('b', 1), [[bundle_id, path]])
+        self.assertEqual(
+            self.queue.complete('a', [[bundle_id, {'from': 'a'}]]), 0)
+        self.assertEqual(
+            self.queue.complete('b', [[bundle_id, {'from': 'b'}]]), 1)
+        self.assertEqual(self.row(path)[::3], ('done', {'from': 'b'}))
+
+    def test_complete_renews_half_expired_leases(self):
+        rows = self.queue.lease('a', 3)
+        soon = time.time() + 10  # less than half of the 60 s duration
+        later = time.time() + 50
+        self.connection.execute(
+            'UPDATE bundles SET lease_expires = ? WHERE id = ?',
+            (soon, rows[1][0]))
+        self.connection.execute(
+            'UPDATE bundles SET lease_expires = ? WHERE id = ?',
+            (later, rows[2][0]))
+        self.queue.complete('a', [[rows[0][0], {}]])
+        expires = dict(self.connection.execute(
+            'SELECT id, lease_expires FROM bundles WHERE id IN (?, ?)',
+            (rows[1][0], rows[2][0])))
+        self.assertGreater(expires[rows[1][0]], later)
+        self.assertEqual(expires[rows[2][0]], later)
+
+    def test_resume_after_restart(self):
+        rows = self.queue.lease('a', 2)
+        self.queue.complete('a', [[rows[0][0], {}]])
+        self.connection.close()
+        self.connection = distribute.connect(self.database)
+        self.queue = distribute.Queue(self.connection, duration=60)
+        self.assertEqual(self.row(self.paths[0])[0], 'done')
+        self.assertEqual(self.row(self.paths[1])[:2], ('leased', 'a'))
+        rows = self.queue.lease('b', 5)
+        self.assertEqual([path for _, path in rows], self.paths[2:])
+
+    def test_work(self):
+        distribute.work(
+            self.queue, 'a', _summary, size=2, flush=1, flush_interval=60,
+            poll=0)
+        self.assertEqual(
+            list(distribute.results(self.connection)),
+            [(path, 'done', _summary(path)) for path in self.paths])
+
+    def test_work_waits_for_expiring_leases(self):
+        self.queue.lease('dead', 1)
+        self.connection.execute(
+            'UPDATE bundles SET lease_expires = ? WHERE worker = ?',
+            (time.time() + 0.2, 'dead'))
+        distribute.work(
+            self.queue, 'a', _summary, size=5, flush=10, flush_interval=60,
+            poll=0.05)
+        self.assertEqual(
+            distribute.status(self.connection), {'done': len(self.paths)})
+
+
+class RemoteTest(unittest.TestCase):
+    def setUp(self):
+        self.directory = tempfile.mkdtemp()
+        self.database = os.path.join(self.directory, 'queue.sqlite')
+        connection = distribute.connect(self.database)
+        self.paths = ['/bundle-{}'.format(i) for i in range(5)]
+        distribute.add(connection, self.paths)
+        connection.close()
+        self.server = distribute.make_server(
+            self.database, ('localhost', 0), duration=60, attempts=3)
+        self.thread = threading.Thread(target=self.server.serve_forever)
+        self.thread.start()
+
+    def tearDown(self):
+        self.server.shutdown()
+        self.thread.join()
+        self.server.server_close()
+        self.server.instance.connection.close()
+        shutil.rmtree(self.directory)
+
+    def test_work(self):
+        queue = distribute._Remote(
+            self.server.server_address, retry=5, poll=0.05)
+        distribute.work(
+            queue, 'a', _summary, size=2, flush=1, flush_interval=60,
+            poll=0)
+        connection = distribute.connect(self.database)
+        try:
+            self.assertEqual(
+                list(distribute.results(connection)),
+                [(path, 'done', _summary(path)) for path in self.paths])
+        finally:
+            connection.close()
+
+
+class SuperviseTest(unittest.TestCase):
+    def test_restarts_crashed_workers(self):
+        directory = tempfile.mkdtemp()
+        try:
+            flag = os.path.join(directory, 'crashed')
+            self.assertTrue(distribute.supervise(
+                _crash_once, (flag,), jobs=1, restarts=1))
+            os.remove(flag)
+            self.assertFalse(distribute.supervise(
+                _crash_once, (flag,), jobs=1, restarts=0))
+        finally:
+            shutil.rmtree(directory)
@@ -0,0 +1,173 @@
+# Copyright 2016 W. Trevor King <wking@tremily.us>
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#     http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+
+"""Opt-in profiling for slow or memory-hungry bundles.
+
+Set PROFILE_DIR to enable.  Each phase (loading the configuration,
+and each test) is timed with a cheap clock and a peak-RSS check.
+Only when a phase crosses PROFILE_SECONDS (default 1) or
+PROFILE_BYTES (default unlimited) is it run a second time under
+cProfile and tracemalloc, and the results are written to PROFILE_DIR
+as {bundle}.{phase}.prof and {bundle}.{phase}.tracemalloc.  Load the
+former with pstats and the latter with tracemalloc.Snapshot.load.
+The snapshot is taken at the end of the phase, so {bundle}.{phase}.peak
+also records tracemalloc's peak, which catches short-lived
+allocations the snapshot misses.
+
+The second run starts from the state the first run left behind.  The
+load phase reopens archive bundles, but warm OS caches (and any other
+state cached in memory) mean the profile may not show the cache
+misses or I/O waits that made the first run slow.
+
+On Linux the peak RSS is reset before each phase, so PROFILE_BYTES
+catches any phase whose peak rises that far above its starting RSS.
+Elsewhere only phases that set a new peak for the whole process are
+detected.
+
+Failing to write the profile only produces a warning; it never
+changes the validation results.
+"""
+
+import cProfile
+import hashlib
+import os
+import re
+import sys
+import time
+import tracemalloc
+import urllib.parse
+import warnings
+
+try:
+    import resource
+except ImportError:  # not available on Windows
+    resource = None
+
+
+PROFILE_DIR = os.environ.get('PROFILE_DIR')
+PROFILE_SECONDS = float(os.environ.get('PROFILE_SECONDS', 1))
+PROFILE_BYTES = int(os.environ.get('PROFILE_BYTES', 0))
+
+# Keep file names well under the usual 255-byte limit.
+_MAX_NAME = 120
+
+_VM_HWM_REGEX = re.compile(r'^VmHWM:\s+(\d+) kB$', re.MULTILINE)
+
+# Set while a profile is being recorded, so nested phases (like a
+# test's own setUp) are not profiled again.
+_RECORDING = False
+
+
+def _reset_peak_rss():
+    """Reset the peak RSS to the current RSS, if the OS allows it."""
+    try:
+        with open('/proc/self/clear_refs', 'w') as f:
+            f.write('5')
+    except OSError:
+        pass
+
+
+def _peak_rss():
+    """Return the peak resident set size in bytes (or 0 if unknown)."""
+    try:
+        with open('/proc/self/status') as f:
+            match = _VM_HWM_REGEX.search(f.read())
+    except OSError:
+        match = None
+    if match:
+        return int(match.group(1)) * 1024
+    if resource is None:
+        return 0
+    peak = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+    if sys.platform == 'darwin':
+        return peak  # already in bytes
+    return peak * 1024  # Linux (and the BSDs) report KiB
+
+
+def _prefix(phase):
+    bundle = os.path.abspath(os.environ.get('BUNDLE', '.'))
+    name = urllib.parse.quote(bundle, safe='')
+    if len(name) > _MAX_NAME:
+        digest = hashlib.sha256(bundle.encode('UTF-8', 'surrogateescape'))
+        name = '{}-{}'.format(
+            digest.hexdigest()[:16], name[-(_MAX_NAME - 17):])
+    return os.path.join(PROFILE_DIR, '{}.{}'.format(name, phase))
+
+
+def _record(phase, rerun):
+    """Call rerun under cProfile and tracemalloc and save the results.
+
+    Any exception raised by this second run is discarded; the caller
+    has already seen the result of the first run.  Errors writing the
+    results are reported as warnings.
+    """
+    global _RECORDING
+    prefix = _prefix(phase)
+    profiler = cProfile.Profile()
+    tracing = tracemalloc.is_tracing()
+    if tracing:
+        tracemalloc.reset_peak()
+    else:
+        tracemalloc.start()
+    _RECORDING = True
+    try:
+        result = None
+        profiler.enable()
+        try:
+            result = rerun()
+        except Exception:
+            pass
+        finally:
+            profiler.disable()
+        # Take the snapshot while result still holds whatever the
+        # phase allocated.
+        snapshot = tracemalloc.take_snapshot()
+        current, peak = tracemalloc.get_traced_memory()
+        del result
+    finally:
+        _RECORDING = False
+        if not tracing:
+            tracemalloc.stop()
+    try:
+        os.makedirs(PROFILE_DIR, exist_ok=True)
+        profiler.dump_stats('{}.prof'.format(prefix))
+        snapshot.dump('{}.tracemalloc'.format(prefix))
+        with open('{}.peak'.format(prefix), 'w') as f:
+            f.write('current {} bytes\npeak {} bytes\n'.format(
+                current, peak))
+    except OSError as error:
+        warnings.warn('unable to save profile for {}: {}'.format(
+            prefix, error))
+
+
+def call(phase, func, rerun=None):
+    """Call func, profiling it if it crosses a configured threshold.
+
+    The profile comes from calling rerun (default func) a second
+    time.  When PROFILE_DIR is unset, or while a profile is being
+    recorded, this is a plain call.
+    """
+    if not PROFILE_DIR or _RECORDING:
+        return func()
+    _reset_peak_rss()
+    start_rss = _peak_rss()
+    start = time.perf_counter()
+    try:
+        return func()
+    finally:
+        elapsed = time.perf_counter() - start
+        grown = _peak_rss() - start_rss
+        if (elapsed >= PROFILE_SECONDS or
+                (PROFILE_BYTES and grown >= PROFILE_BYTES)):
+            _record(phase, rerun or func)
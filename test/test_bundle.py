@@ -13,12 +13,11 @@
 # limitations under the License.
 
 import os
-import unittest
 
 from . import util
 
 
-class TestBundle(unittest.TestCase):
+class TestBundle(util.TestCase):
     def test_configuration(self):
         """config.json MUST reside in the root of the bundle directory.
 
@@ -31,9 +30,12 @@ class TestBundle(unittest.TestCase):
         [1]: https://github.com/opencontainers/runtime-spec/blob/v1.0.0-rc1/bundle.md#container-format
         [2]: https://github.com/opencontainers/runtime-spec/blob/v0.5.0/bundle.md#container-format
         """
+        self.assertIsNone(
+            util.archive_error(),
+            'unable to read the bundle archive')
         self.assertTrue(
-            os.path.exists(util.CONFIG_PATH),
-            'no file found at {}'.format(util.CONFIG_PATH))
+            util.exists('config.json'),
+            'unable to find {}'.format(util.CONFIG_LOCATION))
         self.assertIsNotNone(
             util.CONFIG_BYTES, 'unable to read configuration JSON')
 
@@ -98,10 +100,14 @@ class TestBundle(unittest.TestCase):
         self.assertIn('path', sorted(root.keys()), 'root.path is not set')
         path = root['path']
         self.assertTrue(isinstance(path, str), 'root.path is not a string')
-        bundle = os.environ.get('BUNDLE', '.')
+        bundle = util.BUNDLE
         root_path = os.path.join(bundle, path)
+        is_dir = util.isdir(path)
+        self.assertIsNone(
+            util.archive_error(),
+            'unable to read the bundle archive')
         self.assertTrue(
-            os.path.isdir(root_path),
+            is_dir,
             'the configured root.path ({}) does not point to a directory'
             .format(path)
         )
@@ -18,7 +18,7 @@ import unittest
 from . import util
 
 
-class TestMounts(unittest.TestCase):
+class TestMounts(util.TestCase):
     @util.skip_if_unrecognized_version
     def test_destination(self):
         """destination (string, required).
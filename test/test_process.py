@@ -19,7 +19,7 @@ import unittest
 from . import util
 
 
-class TestProcess(unittest.TestCase):
+class TestProcess(util.TestCase):
     ENVIRONMENT_VARIABLE_KEY_INVALID_REGEX = re.compile('[^a-zA-Z0-9_]')
 
     @util.skip_if_unrecognized_version
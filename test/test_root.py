@@ -13,14 +13,13 @@
 # limitations under the License.
 
 import os.path
-import unittest
 
 import semver
 
 from . import util
 
 
-class TestRoot(unittest.TestCase):
+class TestRoot(util.TestCase):
     @util.skip_if_unrecognized_version
     @util.skip_unless_path_separator_matches
     def test_path(self):
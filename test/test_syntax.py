@@ -13,17 +13,16 @@
 # limitations under the License.
 
 import json
-import os
 import unittest
 
 from . import util
 
 
-class TestSyntax(unittest.TestCase):
+class TestSyntax(util.TestCase):
     @unittest.skipIf(
-        not os.path.exists(util.CONFIG_PATH),
+        not util.exists('config.json'),
         'cannot test configuration JSON with a missing {}'
-        .format(util.CONFIG_PATH))
+        .format(util.CONFIG_LOCATION))
     def test_syntax(self):
         """All configuration JSON MUST be encoded in UTF-8.
 
@@ -34,7 +33,8 @@ class TestSyntax(unittest.TestCase):
         """
         self.assertTrue(
             util.CONFIG_BYTES,
-            'unable to read any content from {}'.format(util.CONFIG_PATH))
+            'unable to read any content from {}'
+            .format(util.CONFIG_LOCATION))
         try:
             config_string = util.CONFIG_BYTES.decode('UTF-8')
         except ValueError as error:
@@ -19,7 +19,7 @@ import semver
 from . import util
 
 
-class TestVersion(unittest.TestCase):
+class TestVersion(util.TestCase):
     @unittest.skipIf(
         not util.VERSION,
         'cannot check for recognized version without a version string')
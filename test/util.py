@@ -12,9 +12,15 @@
 # See the License for the specific language governing permissions and
 # limitations under the License.
 
+import functools
 import json
 import os
+import posixpath
+import tarfile
 import unittest
+import zlib
+
+from . import profiling
 
 
 VERSIONS = [  # supported specification versions
@@ -22,40 +28,245 @@ VERSIONS = [  # supported specification versions
     '0.5.0',
 ]
 
-CONFIG_PATH = os.path.join(os.environ.get('BUNDLE', '.'), 'config.json')
-CONFIG_BYTES = CONFIG_JSON = VERSION = PLATFORM_OS = None
-try:
-    with open(CONFIG_PATH, 'rb') as f:
-        CONFIG_BYTES = f.read()
-except FileNotFoundError:
-    pass
+BUNDLE = os.environ.get('BUNDLE', '.')
+CONFIG_PATH = os.path.join(BUNDLE, 'config.json')
+# Where config.json lives, for messages.  CONFIG_PATH is not a real
+# path for archive bundles.
+if os.path.isfile(BUNDLE):
+    CONFIG_LOCATION = 'config.json in the {} archive'.format(BUNDLE)
 else:
+    CONFIG_LOCATION = CONFIG_PATH
+
+# When BUNDLE is a file, it is a (possibly compressed) tar archive of
+# the bundle directory.  Rather than extracting it, we stream through
+# it, reading config.json and indexing member paths.  The stream is
+# only read as far as needed to answer the questions asked so far, so
+# a bundle whose config.json and root directory come early in the
+# archive does not pay for reading the whole root filesystem.
+ARCHIVE = None
+
+# Limit symlink chains when resolving paths inside an archive.
+_MAX_SYMLINKS = 40
+
+
+def _member_name(name):
+    """Normalize an archive member (or bundle-relative) path."""
+    return posixpath.normpath(name.replace(os.path.sep, '/')).lstrip('/')
+
+
+class _TarInfo(tarfile.TarInfo):
+    """TarInfo that notes when the end-of-archive marker is read.
+
+    In stream mode, tarfile treats a truncated archive like a complete
+    one, so we need this to tell them apart.
+    """
+
+    @classmethod
+    def fromtarfile(cls, tar):
+        try:
+            return super().fromtarfile(tar)
+        except tarfile.EOFHeaderError:
+            tar.end_of_archive = True
+            raise
+
+
+class _Archive(object):
+    """Lazily indexed tarball.
+
+    members maps each normalized member path seen so far to ('dir',
+    None), ('file', None), or ('link', target).  Directories that are
+    only implied by their children's paths are indexed as 'dir'.
+    If the archive is truncated or corrupt, indexing stops and error
+    holds a description of the problem.
+    """
+
+    def __init__(self, path):
+        self._tar = tarfile.open(path, mode='r|*', tarinfo=_TarInfo)
+        self.members = {}
+        self.config_bytes = None
+        self.error = None
+
+    def close(self):
+        if self._tar is not None:
+            self._tar.close()
+            self._tar = None
+
+    def _next(self):
+        """Index the next member.  Return False at the end of the stream."""
+        if self._tar is None:
+            return False
+        try:
+            return self._index_next()
+        except (tarfile.TarError, EOFError, zlib.error, OSError) as error:
+            self.error = '{}: {}'.format(type(error).__name__, error)
+            self.close()
+            return False
+
+    def _index_next(self):
+        member = self._tar.next()
+        if member is None:
+            if not getattr(self._tar, 'end_of_archive', False):
+                self.error = (
+                    'archive ends without an end-of-archive marker '
+                    '(truncated?)')
+            self.close()
+            return False
+        name = _member_name(member.name)
+        if name == '.':
+            return True
+        parts = name.split('/')
+        for i in range(1, len(parts)):  # implied parent directories
+            self.members.setdefault('/'.join(parts[:i]), ('dir', None))
+        if member.isdir():
+            self.members[name] = ('dir', None)
+        elif member.issym():
+            self.members[name] = ('link', member.linkname)
+        else:
+            self.members[name] = ('file', None)
+            if name == 'config.json' and member.isfile():
+                self.config_bytes = self._tar.extractfile(member).read()
+        return True
+
+    def get(self, name):
+        """Return the entry for name, reading further if necessary."""
+        while name not in self.members and self._next():
+            pass
+        return self.members.get(name)
+
+
+def close():
+    """Release the archive stream, if any."""
+    if ARCHIVE is not None:
+        ARCHIVE.close()
+
+
+def _open_archive():
+    """(Re)open ARCHIVE, so each load streams the archive from the start."""
+    global ARCHIVE
+    close()
+    ARCHIVE = None
+    if os.path.isfile(BUNDLE):
+        try:
+            ARCHIVE = _Archive(BUNDLE)
+        except tarfile.ReadError:
+            pass  # not an archive; we will fail to find config.json
+
+
+def archive_error():
+    """Return a description of any error reading the archive, or None."""
+    if ARCHIVE is None:
+        return None
+    return ARCHIVE.error
+
+
+def _read_config():
+    if ARCHIVE is None:
+        with open(CONFIG_PATH, 'rb') as f:
+            return f.read()
+    ARCHIVE.get('config.json')
+    if ARCHIVE.config_bytes is None:
+        raise FileNotFoundError(CONFIG_PATH)
+    return ARCHIVE.config_bytes
+
+
+def _lookup(path):
+    """Return the archive entry for a bundle-relative path.
+
+    Symlinks are followed.  Returns None for missing members and
+    ('host', target) for symlinks that leave the archive.
+    """
+    name = _member_name(path)
+    for _ in range(_MAX_SYMLINKS):
+        entry = ARCHIVE.get(name)
+        if entry is None or entry[0] != 'link':
+            return entry
+        target = entry[1]
+        if posixpath.isabs(target):
+            return ('host', target)
+        name = _member_name(posixpath.join(posixpath.dirname(name), target))
+    return None
+
+
+def exists(path):
+    """Return True if path (relative to the bundle) exists."""
+    if ARCHIVE is None or os.path.isabs(path):
+        return os.path.exists(os.path.join(BUNDLE, path))
+    entry = _lookup(path)
+    if entry is not None and entry[0] == 'host':
+        return os.path.exists(entry[1])
+    return entry is not None
+
+
+def isdir(path):
+    """Return True if path (relative to the bundle) is a directory."""
+    if ARCHIVE is None or os.path.isabs(path):
+        return os.path.isdir(os.path.join(BUNDLE, path))
+    entry = _lookup(path)
+    if entry is not None and entry[0] == 'host':
+        return os.path.isdir(entry[1])
+    return entry is not None and entry[0] == 'dir'
+
+
+def _load():
+    """Return (CONFIG_BYTES, CONFIG_JSON, VERSION, PLATFORM_OS)."""
+    _open_archive()
+    try:
+        config_bytes = _read_config()
+    except (FileNotFoundError, NotADirectoryError):
+        return None, None, None, None
     try:
         # All configuration JSON MUST be encoded in UTF-8.
         # https://github.com/opencontainers/runtime-spec/blob/v1.0.0-rc1/glossary.md#json
         # https://github.com/opencontainers/runtime-spec/blob/v0.5.0/glossary.md#json
-        _config_string = CONFIG_BYTES.decode('UTF-8')
+        config_string = config_bytes.decode('UTF-8')
     except UnicodeDecodeError:
-        pass
-    else:
-        try:
-            CONFIG_JSON = json.loads(_config_string)
-        except ValueError:
-            pass
-        else:
-            # ociVersion (string, required)
-            # https://github.com/opencontainers/runtime-spec/blob/v1.0.0-rc1/config.md#specification-version
-            # https://github.com/opencontainers/runtime-spec/blob/v0.5.0/config.md#specification-version
-            VERSION = CONFIG_JSON.get('ociVersion')
-
-            # platform.os (string, required) ...
-            # Bundles SHOULD use, and runtimes SHOULD understand, os entries
-            # listed in the Go Language document for $GOOS.
-            # https://github.com/opencontainers/runtime-spec/blob/v1.0.0-rc1/config.md#platform
-            # Values for os must be in the list specified by the Go Language
-            # document for $GOOS.
-            # https://github.com/opencontainers/runtime-spec/blob/v0.5.0/config.md#platform-specific-configuration
-            PLATFORM_OS = CONFIG_JSON.get('platform', {}).get('os')
+        return config_bytes, None, None, None
+    try:
+        config_json = json.loads(config_string)
+    except ValueError:
+        return config_bytes, None, None, None
+
+    # ociVersion (string, required)
+    # https://github.com/opencontainers/runtime-spec/blob/v1.0.0-rc1/config.md#specification-version
+    # https://github.com/opencontainers/runtime-spec/blob/v0.5.0/config.md#specification-version
+    version = config_json.get('ociVersion')
+
+    # platform.os (string, required) ...
+    # Bundles SHOULD use, and runtimes SHOULD understand, os entries
+    # listed in the Go Language document for $GOOS.
+    # https://github.com/opencontainers/runtime-spec/blob/v1.0.0-rc1/config.md#platform
+    # Values for os must be in the list specified by the Go Language
+    # document for $GOOS.
+    # https://github.com/opencontainers/runtime-spec/blob/v0.5.0/config.md#platform-specific-configuration
+    platform_os = config_json.get('platform', {}).get('os')
+
+    return config_bytes, config_json, version, platform_os
+
+
+CONFIG_BYTES, CONFIG_JSON, VERSION, PLATFORM_OS = profiling.call(
+    'load', _load)
+
+
+class TestCase(unittest.TestCase):
+    """unittest.TestCase that runs each test through profiling.call."""
+
+    def __init__(self, methodName='runTest'):
+        super().__init__(methodName=methodName)
+        if profiling.PROFILE_DIR and methodName != 'runTest':
+            method = getattr(self, methodName)
+            phase = '{}.{}'.format(type(self).__name__, methodName)
+            setattr(self, methodName, self._profiled(phase, method))
+
+    def _profiled(self, phase, method):
+        @functools.wraps(method)
+        def wrapper():
+            # Re-run on a fresh instance with a throwaway result, so
+            # every subTest runs and none are reported twice.
+            return profiling.call(
+                phase, method,
+                rerun=lambda: type(self)(self._testMethodName).run(
+                    unittest.TestResult()))
+        return wrapper
 
 
 def skip_if_unrecognized_version(func):